@@ -1,107 +1,179 @@
 import streamlit as st
 import pandas as pd
-import plotly.express as px
+import numpy as np
+import plotly.graph_objects as go
+import csv
+import hashlib
 import io
+from concurrent.futures import ThreadPoolExecutor, as_completed
 from datetime import datetime, timedelta
 import os
-from github import Github
+import uuid
+import requests
+from streamlit.runtime.scriptrunner import add_script_run_ctx, get_script_run_ctx
+from pandas.api.types import union_categoricals
+import pyarrow as pa
+import pyarrow.csv as pacsv
 
 
 st.set_page_config(page_title="ABA - Sales", page_icon="📊",
                    layout="wide", initial_sidebar_state="expanded")
 
 PASTA_CSV_LOCAL = "data"
+PASTA_CACHE = ".cache"
+VERSAO_CACHE = "1"  # mudar sempre que o formato devolvido por processar_csv mudar
 SENHA_CORRETA = st.secrets.get("PASSWORD", "")
 GITHUB_TOKEN = st.secrets.get("GITHUB_TOKEN", "")
 GITHUB_REPO = "tiagomazza/aba-sales"
+GITHUB_API = "https://api.github.com"
+COLUNAS_CSV = {'Data', 'Terceiro', 'Doc.', 'Nome [Clientes]', 'Vendedor', 'Família [Artigos]',
+               'Valor [Documentos GC Lin]', 'Motivo de anulação do documento'}
+COLUNAS_CATEGORICAS = ('FAMILIA', 'vendedor', 'cliente', 'documento', 'arquivo')
+SEM_ASPAS = str.maketrans('', '', '="')
+VALOR_PT = str.maketrans({',': '.', '€': None})
+MILHARES_PT = str.maketrans({',': '.', '.': ','})
+DOCUMENTOS_DEBITO = {'NC', 'NCA', 'NCM', 'NCS', 'NFI', 'QUE', 'ND'}
 
 
 def format_pt(value):
     if pd.isna(value) or value == 0:
         return '0,00'
     try:
-        s = f"{abs(value):,.2f}".replace(',', 'X').replace('.', ',').replace('X', '.')
-        return f"{'-' if value < 0 else ''}{s}"
-    except:
+        return f"{value:,.2f}".translate(MILHARES_PT)
+    except (TypeError, ValueError):
         return str(value)
 
 
-def valor_liquido(row):
-    if pd.isna(row['venda_bruta']):
-        return 0
-    doc = str(row['Doc.']).upper()
-    debitos = {'NC', 'NCA', 'NCM', 'NCS', 'NFI', 'QUE', 'ND'}
-    return -row['venda_bruta'] if doc in debitos else row['venda_bruta']
-
-
-def obter_data_upload_github(nome_arquivo, repo_nome, token=""):
-    if not token:
-        return None
+def valor_liquido(documento, venda_bruta):
+    """Valor com sinal: negativo nos documentos de débito (tabela por categoria de documento)"""
+    debito = np.array([c.upper() in DOCUMENTOS_DEBITO for c in documento.cat.categories], dtype=bool)
+    codes = documento.cat.codes.to_numpy()
+    return np.where(debito[codes] & (codes >= 0), -venda_bruta, venda_bruta)
+
+
+def data_ultimo_commit(repo_nome, nome_arquivo, token):
+    """Data do último commit do ficheiro, ou None; cada chamada usa a sua sessão HTTP"""
+    with requests.Session() as sessao:
+        sessao.headers.update({'Authorization': f'Bearer {token}',
+                               'Accept': 'application/vnd.github+json'})
+        for caminho in (nome_arquivo, f"data/{nome_arquivo}"):
+            # per_page=1: só o commit mais recente, num único pedido
+            r = sessao.get(f"{GITHUB_API}/repos/{repo_nome}/commits",
+                           params={'path': caminho, 'per_page': 1}, timeout=10)
+            if r.status_code == 404:
+                continue  # caminho inexistente: tenta o seguinte
+            r.raise_for_status()  # 401/403 (token, limite de pedidos) chegam ao utilizador
+            commits = r.json()
+            if commits:
+                data = commits[0]['commit']['committer']['date'].replace('Z', '+00:00')
+                return datetime.fromisoformat(data).replace(tzinfo=None)
+    return None
+
+
+@st.cache_data(ttl=3600, show_spinner=False)
+def obter_datas_upload_github(nomes_arquivos, repo_nome, token=""):
+    """Datas do último commit de cada ficheiro; caminhos inexistentes ficam com None"""
+    if not token or not nomes_arquivos:
+        return {}
     try:
-        g = Github(token)
-        repo = g.get_repo(repo_nome)
-        caminhos = [nome_arquivo, f"data/{nome_arquivo}"]
-        for caminho in caminhos:
-            try:
-                conteudo = repo.get_contents(caminho)
-                if hasattr(conteudo, 'last_commit') and conteudo.last_commit:
-                    return conteudo.last_commit.commit.committer.date.replace(tzinfo=None)
-                commits = list(repo.get_commits(path=caminho))[:1]
-                if commits:
-                    return commits[0].commit.committer.date.replace(tzinfo=None)
-            except:
-                continue
-        return None
+        with ThreadPoolExecutor(max_workers=min(4, len(nomes_arquivos))) as ex:
+            datas = ex.map(lambda nome: data_ultimo_commit(repo_nome, nome, token), nomes_arquivos)
+            return dict(zip(nomes_arquivos, datas))
     except Exception as e:
         st.error(f"GitHub erro: {e}")
-        return None
-
-
+        return {}
+
+
+def montar_cliente(terceiro, nome):
+    """Monta a coluna cliente como 'Terceiro - Nome' (categórica); o texto só é tratado por par único"""
+    t_codes, t_unicos = pd.factorize(terceiro)
+    n_codes, n_unicos = pd.factorize(nome)
+    pares, inverso = np.unique(t_codes.astype(np.int64) * len(n_unicos) + n_codes, return_inverse=True)
+    rotulos = (pd.Index(t_unicos).str.translate(SEM_ASPAS)[pares // len(n_unicos)]
+               + ' - ' + pd.Index(n_unicos)[pares % len(n_unicos)])
+    categorias, codes = np.unique(rotulos.to_numpy(dtype=object), return_inverse=True)
+    return pd.Categorical.from_codes(codes[inverso], categories=categorias)
+
+
+def converter_valores(valores):
+    """Converte "1234,56€" em float; cada texto distinto é convertido uma única vez"""
+    codes, unicos = pd.factorize(valores)
+    numeros = pd.to_numeric(pd.Index(unicos).str.translate(VALOR_PT), errors='coerce').to_numpy(dtype=float)
+    return np.where(codes >= 0, numeros[codes], np.nan)
+
+
+def ler_csv(raw, skip):
+    """Lê só as colunas usadas, todas como texto, com o leitor multi-thread do pyarrow"""
+    cabecalho = next(csv.reader([raw.split(b'\n', skip + 1)[skip].decode('latin1')]))
+    colunas = [c for c in cabecalho if c.strip() in COLUNAS_CSV]
+    curtas = []
+
+    def linha_invalida(linha):
+        # Campos a mais: descarta. Linhas curtas (ex.: sem o "Motivo de anulação" final) são
+        # vendas válidas: o pyarrow não as completa, ficam guardadas e são juntadas no fim
+        if linha.actual_columns < linha.expected_columns:
+            curtas.append(linha.text)
+        return 'skip'
+
+    tabela = pacsv.read_csv(
+        io.BytesIO(raw),
+        read_options=pacsv.ReadOptions(skip_rows=skip, encoding='latin1'),
+        parse_options=pacsv.ParseOptions(newlines_in_values=True, invalid_row_handler=linha_invalida),
+        convert_options=pacsv.ConvertOptions(include_columns=colunas, strings_can_be_null=True,
+                                             column_types={c: pa.string() for c in colunas}),
+    )
+    df = tabela.to_pandas()
+    if curtas:
+        # Completa com nulos, como o motor C do pandas
+        posicoes = [cabecalho.index(c) for c in colunas]
+        linhas = [campos + [''] * (len(cabecalho) - len(campos)) for campos in csv.reader(curtas)]
+        extra = pd.DataFrame([[campos[i] or None for i in posicoes] for campos in linhas], columns=colunas)
+        df = pd.concat([df, extra.astype(df.dtypes.to_dict())], ignore_index=True)
+    df.columns = df.columns.str.strip()
+    return df
+
+
+@st.cache_data(show_spinner=False, max_entries=32)
 def processar_csv(conteudo, nome_arquivo=""):
     try:
-        if isinstance(conteudo, bytes):
-            content = conteudo.decode('latin1')
-        else:
-            content = conteudo.read().decode('latin1') if hasattr(conteudo, 'read') else conteudo.decode('latin1')
+        raw = conteudo if isinstance(conteudo, bytes) else conteudo.read()
+        # Linha "sep=," do Excel antes do cabeçalho
+        skip = 1 if raw.lstrip(b'\xef\xbb\xbf')[:4].lower() == b'sep=' else 0
 
-        lines = content.split('\n')
-        data_lines = [line for line in lines[1:] if line.strip() and not line.startswith('sep=')]
-        csv_content = '\n'.join(data_lines)
-
-        df = pd.read_csv(io.StringIO(csv_content), sep=',', quotechar='"',
-                         encoding='latin1', on_bad_lines='skip', engine='python')
-        df.columns = df.columns.str.strip().str.replace('"', '')
+        df = ler_csv(raw, skip)
 
         df['data'] = pd.to_datetime(df['Data'], format='%d-%m-%Y', errors='coerce')
         df['FAMILIA'] = df['Família [Artigos]'].fillna('SEM_FAMILIA').astype(str)
-        df['documento'] = df.get('Doc.', '').fillna('').astype(str)
+        df['documento'] = df.get('Doc.', '').fillna('').astype(str).astype('category')
         df['vendedor'] = df['Vendedor'].fillna('SEM_VENDEDOR').astype(str)
 
-        df['cliente'] = (
-            df.get('Terceiro', pd.Series([''] * len(df)))
-            .fillna('').astype(str).str.replace('=', '').str.replace('"', '')
-            + ' - ' + df['Nome [Clientes]'].fillna('SEM_CLIENTE')
-        )
-
-        df['venda_bruta'] = pd.to_numeric(
-            df['Valor [Documentos GC Lin]'].astype(str).str.replace(',', '.').str.replace('€', ''),
-            errors='coerce'
+        df['cliente'] = montar_cliente(
+            df.get('Terceiro', pd.Series('', index=df.index)).fillna('').astype(str),
+            df['Nome [Clientes]'].fillna('SEM_CLIENTE').astype(str)
         )
 
-        df['valor_vendido'] = df.apply(valor_liquido, axis=1)
-        df_clean = df.dropna(subset=['data', 'valor_vendido'])
-        df_clean = df_clean[df_clean['venda_bruta'] > 0].copy()
-
-        if 'Motivo de anulação do documento' in df_clean.columns:
-            anuladas = df_clean['Motivo de anulação do documento'].notna() & \
-                       (df_clean['Motivo de anulação do documento'] != '')
-            df_clean = df_clean[~anuladas].copy()
-
-        df_clean['arquivo'] = nome_arquivo
-        return df_clean[['data', 'FAMILIA', 'vendedor', 'cliente', 'documento', 'valor_vendido', 'arquivo']]
+        df['venda_bruta'] = converter_valores(df['Valor [Documentos GC Lin]'])
+
+        df['valor_vendido'] = valor_liquido(df['documento'], df['venda_bruta'].to_numpy())
+        # Uma só máscara (data válida, valor > 0, não anulada) e um só corte
+        validas = df['data'].notna().to_numpy() & (df['venda_bruta'].to_numpy() > 0)
+        if 'Motivo de anulação do documento' in df.columns:
+            motivo = df['Motivo de anulação do documento']
+            validas &= ~(motivo.notna() & (motivo != '')).to_numpy()
+
+        df_clean = df.loc[validas, ['data', 'FAMILIA', 'vendedor', 'cliente', 'documento', 'valor_vendido']]
+        df_clean = df_clean.assign(
+            # Dia como inteiro (dias desde 1970-01-01) para filtros e agrupamentos
+            data_ord=df_clean['data'].values.astype('datetime64[D]').astype('int32'),
+            arquivo=nome_arquivo,
+        )[['data', 'data_ord', 'FAMILIA', 'vendedor', 'cliente', 'documento', 'valor_vendido', 'arquivo']]
+        df_clean = df_clean.astype({c: 'category' for c in COLUNAS_CATEGORICAS})
+        for c in COLUNAS_CATEGORICAS:
+            df_clean[c] = df_clean[c].cat.remove_unused_categories()
+        return df_clean
     except Exception as e:
         st.error(f"Erro CSV: {e}")
-        return pd.DataFrame()
+        return None  # falha de leitura; um DataFrame vazio é um ficheiro válido sem vendas
 
 
 def listar_csvs_pasta_local(pasta):
@@ -110,51 +182,232 @@ def listar_csvs_pasta_local(pasta):
     return [f for f in os.listdir(pasta) if f.lower().endswith('.csv')]
 
 
+def carregar_csv_local(pasta, nome):
+    with open(os.path.join(pasta, nome), 'rb') as f:
+        conteudo = f.read()
+    return processar_csv(conteudo, nome)
+
+
 def carregar_csvs_pasta_local(pasta):
     arquivos = listar_csvs_pasta_local(pasta)
     if not arquivos:
         return [], pd.DataFrame(), {}
 
-    dfs, datas_upload = [], {}
-    progress_bar = st.progress(0)
+    resultados = {}
+    # Todos os ficheiros ficam no dicionário, com None quando não há data (também com a cache)
+    datas_upload = {nome: None for nome in arquivos}
+    datas_upload.update(obter_datas_upload_github(tuple(arquivos), GITHUB_REPO, GITHUB_TOKEN))
 
-    for i, nome in enumerate(arquivos):
-        st.info(f"📥 {nome}")
+    # Parquet já processado para exatamente estes ficheiros → sem parsing de CSV
+    caminho_cache = os.path.join(PASTA_CACHE, f"{assinatura_arquivos(pasta, arquivos)}.parquet")
+    if os.path.exists(caminho_cache):
         try:
-            with open(os.path.join(pasta, nome), 'rb') as f:
-                conteudo = f.read()
+            df_final = pd.read_parquet(caminho_cache)
+            st.info(f"📦 {len(arquivos)} ficheiros lidos da cache")
+            return arquivos, df_final, datas_upload
+        except Exception as e:
+            st.warning(f"⚠️ Cache inválida: {e}")
 
-            data_upload = obter_data_upload_github(nome, GITHUB_REPO, GITHUB_TOKEN)
-            datas_upload[nome] = data_upload
+    progress_bar = st.progress(0)
+    n_threads = int(os.environ.get('LOAD_THREADS', min(8, os.cpu_count() or 1)))
+
+    # Leitura e parsing em paralelo; mensagens ficam na thread principal
+    with ThreadPoolExecutor(max_workers=max(1, min(n_threads, len(arquivos))),
+                            initializer=add_script_run_ctx,
+                            initargs=(None, get_script_run_ctx())) as ex:
+        futures = {ex.submit(carregar_csv_local, pasta, nome): nome for nome in arquivos}
+        for i, future in enumerate(as_completed(futures)):
+            nome = futures[future]
+            st.info(f"📥 {nome}")
+            try:
+                df_temp = future.result()
+                if df_temp is None:
+                    raise ValueError("ficheiro não processado")
+                data_upload = datas_upload[nome]
 
-            if data_upload:
-                st.success(f"✅ {nome}: {data_upload.strftime('%d/%m %H:%M')}")
-            else:
-                st.warning(f"⚠️ {nome}: Sem data de atualização")
+                if data_upload:
+                    st.success(f"✅ {nome}: {data_upload.strftime('%d/%m %H:%M')}")
+                else:
+                    st.warning(f"⚠️ {nome}: Sem data de atualização")
 
-            df_temp = processar_csv(conteudo, nome)
-            if not df_temp.empty:
-                dfs.append(df_temp)
+                resultados[nome] = df_temp
 
-        except Exception as e:
-            st.error(f"❌ Erro {nome}: {e}")
+            except Exception as e:
+                st.error(f"❌ Erro {nome}: {e}")
 
-        progress_bar.progress((i + 1) / len(arquivos))
+            progress_bar.progress((i + 1) / len(arquivos))
     progress_bar.empty()
 
-    df_final = pd.concat(dfs, ignore_index=True) if dfs else pd.DataFrame()
+    df_final = concatenar_dfs([resultados[n] for n in arquivos if n in resultados])
+    # Só grava a cache se nenhum ficheiro falhou, senão a falha ficaria escondida na cache
+    if not df_final.empty and len(resultados) == len(arquivos):
+        guardar_cache(df_final, caminho_cache)
     return arquivos, df_final, datas_upload
 
 
+def assinatura_arquivos(pasta, arquivos):
+    """SHA1 de nome, mtime e tamanho dos ficheiros (e da versão do formato da cache)"""
+    h = hashlib.sha1(VERSAO_CACHE.encode())
+    for nome in sorted(arquivos):
+        info = os.stat(os.path.join(pasta, nome))
+        h.update(f"{nome}|{info.st_mtime_ns}|{info.st_size}".encode())
+    return h.hexdigest()
+
+
+def guardar_cache(df, caminho):
+    try:
+        os.makedirs(PASTA_CACHE, exist_ok=True)
+        # Grava num ficheiro temporário e troca de uma vez: outra sessão nunca lê um parquet a meio
+        temporario = f"{caminho}.{uuid.uuid4().hex}.tmp"
+        df.to_parquet(temporario, engine='pyarrow', compression='zstd', index=False)
+        os.replace(temporario, caminho)
+        # Só remove caches mais antigas do que a acabada de gravar
+        limite = os.path.getmtime(caminho)
+        for antigo in os.listdir(PASTA_CACHE):
+            caminho_antigo = os.path.join(PASTA_CACHE, antigo)
+            if not antigo.endswith('.parquet') or caminho_antigo == caminho:
+                continue
+            try:
+                if os.path.getmtime(caminho_antigo) < limite:
+                    os.remove(caminho_antigo)
+            except FileNotFoundError:
+                pass  # já removida por outra sessão
+    except Exception as e:
+        st.warning(f"⚠️ Não foi possível gravar a cache: {e}")
+
+
+def concatenar_dfs(dfs):
+    """Concatena os DataFrames alinhando as categorias das colunas categóricas"""
+    dfs = [d for d in dfs if d is not None and not d.empty]
+    if not dfs:
+        return pd.DataFrame()
+
+    dtypes = {}
+    for col in dfs[0].columns:
+        if all(isinstance(d[col].dtype, pd.CategoricalDtype) for d in dfs):
+            cats = union_categoricals([d[col] for d in dfs], sort_categories=True).categories
+            dtypes[col] = pd.CategoricalDtype(cats)
+    if dtypes:
+        dfs = [d.astype(dtypes) for d in dfs]
+    return pd.concat(dfs, ignore_index=True)
+
+
+# Funções em cache recebem o DataFrame filtrado como `_df_filt` (não hasheado);
+# a `chave` (versão dos dados + filtros) identifica o resultado.
+
+@st.cache_data(show_spinner=False, max_entries=128)
+def agrupar(_df_filt, chave, coluna, valor='valor_vendido', func='sum'):
+    return _df_filt.groupby(coluna, observed=True)[valor].agg(func).reset_index()
+
+
+@st.cache_data(show_spinner=False, max_entries=32)
+def somar_por_categoria(_df_filt, chave, colunas=('FAMILIA', 'vendedor', 'cliente')):
+    """valor_vendido somado por categoria de cada coluna, com bincount sobre os códigos"""
+    valores = _df_filt.valor_vendido.to_numpy()
+    somas = {}
+    for col in colunas:
+        categorias = _df_filt[col].cat.categories
+        codes = _df_filt[col].cat.codes.to_numpy()
+        presentes = np.bincount(codes, minlength=len(categorias)) > 0
+        total = np.bincount(codes, weights=valores, minlength=len(categorias))
+        somas[col] = pd.DataFrame({col: categorias[presentes], 'valor_vendido': total[presentes]})
+    return somas
+
+
+@st.cache_data(show_spinner=False, max_entries=32)
+def tabela_pivot(_resumo, chave, linha, colu, func):
+    """Pivot sobre o resumo diário: a média é soma dos valores / soma das linhas"""
+    if _resumo.empty:
+        return pd.DataFrame()
+    somas = _resumo.pivot_table(index=linha, columns=None if colu == 'Nenhuma' else colu,
+                                values=['valor_vendido', 'linhas'], aggfunc='sum', observed=True)
+    pivot = somas['valor_vendido'] if func == 'sum' else somas['valor_vendido'] / somas['linhas']
+    if colu == 'Nenhuma':
+        return pivot.to_frame('valor_vendido')
+    pivot.columns = pivot.columns.astype(str)
+    return pivot.fillna(0)
+
+
+# As exportações recebem todas as linhas e só as filtram quando o botão é clicado
+@st.cache_data(show_spinner=False, max_entries=8)
+def exportar_csv(_df, chave):
+    buf = io.BytesIO()
+    linhas_filtradas(_df, chave).drop(columns='data_ord').to_csv(buf, index=False, encoding='utf-8-sig')
+    return buf.getvalue()
+
+
+@st.cache_data(show_spinner=False, max_entries=8)
+def exportar_parquet(_df, chave):
+    buf = io.BytesIO()
+    linhas_filtradas(_df, chave).drop(columns='data_ord').to_parquet(buf, engine='pyarrow', compression='zstd',
+                                                                     index=False)
+    return buf.getvalue()
+
+
+def resumir_por_dia(df):
+    """Totais por dia × família × vendedor × cliente × documento, com o nº de linhas"""
+    return df.groupby(['data_ord', 'FAMILIA', 'vendedor', 'cliente', 'documento'], observed=True, as_index=False) \
+             .agg(valor_vendido=('valor_vendido', 'sum'), linhas=('valor_vendido', 'size')) \
+             .astype({'linhas': 'int32'})
+
+
+def mascara_filtros(dados, date_range, vendedor=(), doc_filter=(), familia=()):
+    """Máscara booleana dos filtros da barra lateral sobre `dados` (linhas ou resumo)"""
+    mask = np.ones(len(dados), dtype=bool)
+    if len(date_range) == 2:
+        inicio, fim = (np.datetime64(d, 'D').astype('int32') for d in date_range)
+        dias = dados.data_ord.to_numpy()
+        mask &= (dias >= inicio) & (dias <= fim)
+    for coluna, selecao in (('vendedor', vendedor), ('documento', doc_filter), ('FAMILIA', familia)):
+        if selecao:
+            mask &= dados[coluna].isin(selecao).to_numpy()
+    return mask
+
+
+def linhas_filtradas(dados, chave):
+    """Linhas de `dados` que passam os filtros da `chave`; sem cópia quando nada fica de fora"""
+    mask = mascara_filtros(dados, *chave[1:])
+    return dados if mask.all() else dados.loc[mask]
+
+
+def categorias_presentes(coluna, mask):
+    """Categorias (já ordenadas) que aparecem nas linhas selecionadas pela máscara"""
+    codes = coluna.cat.codes.to_numpy()[mask]
+    presentes = np.bincount(codes[codes >= 0], minlength=len(coluna.cat.categories)) > 0
+    return coluna.cat.categories[presentes].tolist()
+
+
+@st.cache_data(show_spinner=False, max_entries=32)
+def opcoes_filtros(_resumo, versao, date_range):
+    """Opções de vendedor, documento e família no período; só mudam com os dados ou as datas"""
+    mask = mascara_filtros(_resumo, date_range)
+    return tuple(categorias_presentes(_resumo[c], mask) for c in ('vendedor', 'documento', 'FAMILIA'))
+
+
+def valores_grafico(valores):
+    """Valores arredondados ao cêntimo (float64: em float32 os cêntimos perdem-se acima de ~131 mil €)"""
+    return valores.round(2)
+
+
+def grafico_barras(dados, x, y, titulo, texto=None):
+    """Barras montadas direto dos arrays (px.bar custa ~25 ms por gráfico)"""
+    formato = ',.2f' if dados[y].dtype.kind == 'f' else ','
+    return go.Figure(
+        go.Bar(x=dados[x].to_numpy(), y=valores_grafico(dados[y]).to_numpy(),
+               text=None if texto is None else valores_grafico(dados[texto]).to_numpy(),
+               hovertemplate=f"<b>%{{x}}</b><br>{y}: %{{y:{formato}}}<extra></extra>"),
+        layout=dict(title=titulo, xaxis_title=x, yaxis_title=y, uirevision='keep')
+    )
+
+
 def criar_pie_sem_rotulos_menores_1pc(grup_df, nome_categoria, titulo):
     """Cria gráfico de pizza mantendo TODAS fatias, mas sem rótulos < 1%"""
     total_geral = grup_df['valor_vendido'].sum()
     
-    fig_pie = px.pie(
-        grup_df,
-        names=nome_categoria,
-        values='valor_vendido',
-        title=titulo
+    fig_pie = go.Figure(
+        go.Pie(labels=grup_df[nome_categoria].to_numpy(),
+               values=valores_grafico(grup_df['valor_vendido']).to_numpy()),
+        layout=dict(title=titulo)
     )
     
     # Remove rótulos de fatias < 1%
@@ -173,11 +426,14 @@ def criar_pie_sem_rotulos_menores_1pc(grup_df, nome_categoria, titulo):
                       'Percentual: %{percent:.1%}<extra></extra>'
     )
     
+    fig_pie.update_layout(uirevision='keep')
     return fig_pie
 
 
 def main():
     st.title("📊 ABA-SALES Dashboard")
+    # Versão dos dados carregados: muda a cada carga e entra na chave das funções em cache
+    st.session_state.setdefault('versao_dados', None)
 
     st.sidebar.header("🗃️ Carregar ficheiros")
 
@@ -192,17 +448,20 @@ def main():
         if df.empty:
             st.error("❌ Sem dados válidos")
             st.stop()
-        st.session_state.update(df=df, arquivos=arquivos, datas_upload=datas_upload)
+        st.session_state.update(df=df, df_resumo=resumir_por_dia(df), arquivos=arquivos,
+                                datas_upload=datas_upload, versao_dados=uuid.uuid4().hex)
         st.sidebar.success(f"✅ {len(arquivos)} CSV | {len(df):,} linhas")
         st.rerun()
 
     # Upload manual
     uploaded = st.sidebar.file_uploader("📁 Upload manual:", type="csv", accept_multiple_files=True)
-    if uploaded:
-        dfs = [processar_csv(f, f.name) for f in uploaded]
-        df = pd.concat([d for d in dfs if not d.empty], ignore_index=True)
+    uploads = [f.file_id for f in uploaded]
+    if uploaded and st.session_state.get('uploads') != uploads:
+        dfs = [processar_csv(f.getvalue(), f.name) for f in uploaded]
+        df = concatenar_dfs(dfs)
         if not df.empty:
-            st.session_state.update(df=df, arquivos=[f.name for f in uploaded], datas_upload={})
+            st.session_state.update(df=df, df_resumo=resumir_por_dia(df), arquivos=[f.name for f in uploaded],
+                                    datas_upload={}, uploads=uploads, versao_dados=uuid.uuid4().hex)
             st.sidebar.success(f"✅ {len(uploaded)} | {len(df):,} linhas")
             st.rerun()
         else:
@@ -213,6 +472,7 @@ def main():
         st.stop()
 
     df = st.session_state.df
+    df_resumo = st.session_state.df_resumo
     datas_upload = st.session_state.get('datas_upload', {})
 
     # Data de atualização
@@ -233,14 +493,10 @@ def main():
 
     date_range = st.sidebar.date_input("📅 Data", (inicio_mes.date(), ontem.date()))
 
-    df_filt = df.copy()
-    if len(date_range) == 2:
-        df_filt = df_filt[
-            (df_filt.data.dt.date >= date_range[0]) &
-            (df_filt.data.dt.date <= date_range[1])
-        ]
+    # Opções dos filtros a partir do resumo diário no período escolhido
+    vendedores_unicos, docs_unicos, familias_unicas = opcoes_filtros(
+        df_resumo, st.session_state.versao_dados, tuple(date_range))
 
-    vendedores_unicos = sorted(df_filt.vendedor.dropna().unique())
     pre_vend = ['VT', 'OC', 'DB', 'HR', 'AB', 'FL']
     vendedor = st.sidebar.multiselect(
         "🦸 Vendedor",
@@ -248,7 +504,6 @@ def main():
         default=[v for v in pre_vend if v in vendedores_unicos]
     )
 
-    docs_unicos = sorted(df_filt.documento.dropna().unique())
     pre_docs = ['FT', 'FTP', 'NC']
     doc_filter = st.sidebar.multiselect(
         "📄 Documento",
@@ -256,23 +511,21 @@ def main():
         default=[d for d in pre_docs if d in docs_unicos]
     )
 
-    familia = st.sidebar.multiselect("Ⓜ️ Família", sorted(df_filt.FAMILIA.dropna().unique()))
+    familia = st.sidebar.multiselect("Ⓜ️ Família", familias_unicas)
 
-    if vendedor:
-        df_filt = df_filt[df_filt.vendedor.isin(vendedor)]
-    if doc_filter:
-        df_filt = df_filt[df_filt.documento.isin(doc_filter)]
-    if familia:
-        df_filt = df_filt[df_filt.FAMILIA.isin(familia)]
+    # Identifica (dados carregados, filtros) para as agregações em cache
+    chave = (st.session_state.versao_dados, tuple(date_range),
+             tuple(vendedor), tuple(doc_filter), tuple(familia))
+    # Gráficos e KPIs usam o resumo; as linhas originais só servem a exportação
+    resumo = linhas_filtradas(df_resumo, chave)
 
     # KPIs
     st.markdown("### 🏆 KPIs")
     cols = st.columns(5)
-    total = df_filt.valor_vendido.sum()
-    cli = df_filt.cliente.nunique()
-    fam = df_filt.FAMILIA.nunique()
-    vend = df_filt.vendedor.nunique()
-    ticket = total / len(df_filt) if len(df_filt) else 0
+    total = resumo.valor_vendido.to_numpy().sum()
+    linhas = resumo.linhas.to_numpy().sum()
+    cli, fam, vend = resumo[['cliente', 'FAMILIA', 'vendedor']].nunique()
+    ticket = total / linhas if linhas else 0
 
     with cols[0]:
         st.metric("💰 Total", f"€{format_pt(total)}")
@@ -287,24 +540,27 @@ def main():
 
     # Gráficos
     tipo = st.sidebar.selectbox("📊 Gráfico", ["Valor Vendido", "Clientes movimentados"])
+    somas = somar_por_categoria(resumo, chave)
     tabs = st.tabs(["📈 Dia", "Ⓜ️ Família", "🦸 Vendedor", "👥 Cliente", "📊 Pivot"])
 
     with tabs[0]:
         if tipo == "Valor Vendido":
-            diario = df_filt.groupby(df_filt.data.dt.date).valor_vendido.sum().reset_index()
-            fig = px.bar(diario, x='data', y='valor_vendido', title="Diário", text='valor_vendido')
+            diario = agrupar(resumo, chave, 'data_ord', 'valor_vendido', 'sum')
+            diario['data'] = diario.data_ord.to_numpy().astype('datetime64[D]')
+            fig = grafico_barras(diario, 'data', 'valor_vendido', "Diário", texto='valor_vendido')
         else:
-            diario = df_filt.groupby(df_filt.data.dt.date).cliente.nunique().reset_index()
-            fig = px.bar(diario, x='data', y='cliente', title="Clientes Diário", text='cliente')
+            diario = agrupar(resumo, chave, 'data_ord', 'cliente', 'nunique')
+            diario['data'] = diario.data_ord.to_numpy().astype('datetime64[D]')
+            fig = grafico_barras(diario, 'data', 'cliente', "Clientes Diário", texto='cliente')
         fig.update_traces(texttemplate='%{text:,.0f}', textposition='outside')
         st.plotly_chart(fig, use_container_width=True)
 
     with tabs[1]:
         # Agrupamento completo para pizza
-        grup_fam = df_filt.groupby('FAMILIA').valor_vendido.sum().reset_index()
+        grup_fam = somas['FAMILIA']
         # Top 15 para barras
         top = grup_fam.nlargest(15, 'valor_vendido')
-        fig = px.bar(top, x='FAMILIA', y='valor_vendido', title="Top Famílias")
+        fig = grafico_barras(top, 'FAMILIA', 'valor_vendido', "Top Famílias")
         st.plotly_chart(fig, use_container_width=True)
 
         # Pizza com TODAS fatias, mas SEM rótulos < 1%
@@ -312,9 +568,9 @@ def main():
         st.plotly_chart(fig_pie, use_container_width=True)
 
     with tabs[2]:
-        grup_vend = df_filt.groupby('vendedor').valor_vendido.sum().reset_index()
+        grup_vend = somas['vendedor']
         top = grup_vend.nlargest(15, 'valor_vendido')
-        fig = px.bar(top, x='vendedor', y='valor_vendido', title="Top Vendedores")
+        fig = grafico_barras(top, 'vendedor', 'valor_vendido', "Top Vendedores")
         st.plotly_chart(fig, use_container_width=True)
 
         # Pizza com TODAS fatias, mas SEM rótulos < 1%
@@ -322,9 +578,9 @@ def main():
         st.plotly_chart(fig_pie, use_container_width=True)
 
     with tabs[3]:
-        grup_cli = df_filt.groupby('cliente').valor_vendido.sum().reset_index()
+        grup_cli = somas['cliente']
         top = grup_cli.nlargest(15, 'valor_vendido')
-        fig = px.bar(top, x='cliente', y='valor_vendido', title="Top Clientes")
+        fig = grafico_barras(top, 'cliente', 'valor_vendido', "Top Clientes")
         st.plotly_chart(fig, use_container_width=True)
 
         # Pizza com TODAS fatias, mas SEM rótulos < 1%
@@ -339,19 +595,20 @@ def main():
         func_map = {'Soma': 'sum', 'Média': 'mean'}
         func = func_map[func_label]
 
-        if colu == 'Nenhuma':
-            pivot = df_filt.pivot_table(index=linha, values='valor_vendido', aggfunc=func)
-        else:
-            pivot = df_filt.pivot_table(index=linha, columns=colu, values='valor_vendido', aggfunc=func)
+        pivot = tabela_pivot(resumo, chave, linha, colu, func)
 
-        st.dataframe(pivot.style.format(format_pt))
+        # Formato PT fixo (1.234,56), igual ao de format_pt; os valores continuam numéricos para ordenar
+        st.dataframe(pivot.style.format(precision=2, thousands='.', decimal=','))
 
-    csv = df_filt.to_csv(index=False).encode('utf-8-sig')
-    st.download_button(
-        "💾 Exportar CSV",
-        csv,
-        f"vendas_{datetime.now().strftime('%Y%m%d_%H%M')}.csv"
-    )
+    # Ficheiros só são gerados quando o botão é clicado
+    nome_export = f"vendas_{datetime.now().strftime('%Y%m%d_%H%M')}"
+    col_csv, col_parquet = st.columns(2)
+    with col_csv:
+        st.download_button("💾 Exportar CSV", lambda: exportar_csv(df, chave), f"{nome_export}.csv",
+                           mime='text/csv')
+    with col_parquet:
+        st.download_button("💾 Exportar Parquet", lambda: exportar_parquet(df, chave),
+                           f"{nome_export}.parquet", mime='application/octet-stream')
 
 
 if __name__ == "__main__":
@@ -0,0 +1,23 @@
+import streamlit_app as app
+
+CABECALHO = ('"Data","Terceiro","Doc.","Nome [Clientes]","Vendedor","Família [Artigos]",'
+             '"Artigo [Documentos GC Lin]","Valor [Documentos GC Lin]","Motivo de anulação do documento"\r\n')
+
+
+def csv_bytes(*linhas):
+    return ('sep=,\r\n' + CABECALHO + ''.join(l + '\r\n' for l in linhas)).encode('latin1')
+
+
+def test_linha_curta_sem_motivo_de_anulacao_e_mantida():
+    raw = csv_bytes('"23-01-2025",="1298","FT","CLI A","VT","KENNA",="1","10,00",""',
+                    '"24-01-2025",="1299","FT","CLI B","OC","KENNA",="2","20,00"')
+    df = app.processar_csv(raw, 'curta.csv')
+    assert list(df['cliente']) == ['1298 - CLI A', '1299 - CLI B']
+    assert df['valor_vendido'].sum() == 30.0
+
+
+def test_linha_com_campos_a_mais_e_descartada():
+    raw = csv_bytes('"23-01-2025",="1298","FT","CLI A","VT","KENNA",="1","10,00","","x"',
+                    '"25-01-2025",="1","FT","CLI C","VT","K",="1","5,00",""')
+    df = app.ler_csv(raw, 1)
+    assert list(df['Data']) == ['25-01-2025']
@@ -0,0 +1,18 @@
+import pandas as pd
+
+import streamlit_app as app
+from test_ler_csv import csv_bytes
+
+
+def test_remove_aspas_do_terceiro():
+    cliente = app.montar_cliente(pd.Series(['="1298"', '="1298"', '="7"']),
+                                 pd.Series(['CLI A', 'CLI A', 'CLI B']))
+    assert list(cliente) == ['1298 - CLI A', '1298 - CLI A', '7 - CLI B']
+    assert list(cliente.categories) == ['1298 - CLI A', '7 - CLI B']
+
+
+def test_terceiro_ou_nome_em_falta():
+    raw = csv_bytes('"23-01-2025",,"FT","CLI A","VT","K",="1","10,00",""',
+                    '"23-01-2025",="5","FT",,"VT","K",="2","20,00",""')
+    df = app.processar_csv(raw, 'falta.csv')
+    assert list(df['cliente']) == [' - CLI A', '5 - SEM_CLIENTE']
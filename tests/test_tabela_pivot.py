@@ -0,0 +1,23 @@
+import pandas as pd
+
+import streamlit_app as app
+from test_ler_csv import csv_bytes
+
+
+def test_media_igual_a_pivot_table_sobre_as_linhas():
+    # Dois dias para o mesmo vendedor/família (média sobre linhas de vários dias)
+    # e um vendedor sem vendas na família K2 (célula vazia)
+    raw = csv_bytes('"23-01-2025",="1","FT","CLI A","VT","K1",="1","10,00",""',
+                    '"23-01-2025",="1","FT","CLI A","VT","K1",="2","20,00",""',
+                    '"24-01-2025",="2","FT","CLI B","VT","K1",="3","60,00",""',
+                    '"24-01-2025",="2","NC","CLI B","OC","K1",="4","5,00",""',
+                    '"25-01-2025",="1","FT","CLI A","VT","K2",="5","7,50",""')
+    df = app.processar_csv(raw, 'pivot.csv')
+
+    pivot = app.tabela_pivot(app.resumir_por_dia(df), 'teste-pivot', 'vendedor', 'FAMILIA', 'mean')
+    esperado = df.pivot_table(index='vendedor', columns='FAMILIA', values='valor_vendido',
+                              aggfunc='mean', observed=True).fillna(0)
+    esperado.columns = esperado.columns.astype(str)
+
+    pd.testing.assert_frame_equal(pivot, esperado, check_names=False, check_index_type=False)
+    assert pivot.loc['OC', 'K2'] == 0
@@ -0,0 +1,12 @@
+import numpy as np
+import pandas as pd
+
+import streamlit_app as app
+
+
+def test_documentos_de_debito_ficam_negativos():
+    tipos = sorted(app.DOCUMENTOS_DEBITO) + ['FT', 'nc', '']
+    documento = pd.Series(tipos + [None], dtype='category')
+    valores = app.valor_liquido(documento, np.full(len(documento), 10.0))
+    esperado = [-10.0] * len(app.DOCUMENTOS_DEBITO) + [10.0, -10.0, 10.0, 10.0]
+    assert valores.tolist() == esperado